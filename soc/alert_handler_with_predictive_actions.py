@@ -4,18 +4,101 @@ Handles security alerts and CI failures with intelligent action recommendations.
 Integrates with ci-failure-agent predictive actions REST API.
 """
 
-import aiohttp
+import cachetools
+import hashlib
+import httpx
 import logging
 import json
 from typing import Dict, List, Optional
+from collections import deque
 from datetime import datetime
 from dataclasses import dataclass, asdict
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
 import asyncio
+import math
 
 logger = logging.getLogger(__name__)
 
+# Lookup tables shared by all alerts; built once at import instead of
+# per call and frozen against accidental mutation.
+_FAILURE_TYPE_MAP = MappingProxyType({
+    "security_alert": "security_alert",
+    "ci_failure": "ci_failure",
+    "spam_incident": "spam_incident"
+})
 
-@dataclass
+_BUTTON_LABELS = MappingProxyType({
+    "auto_fix": "Execute Fix",
+    "manual_review": "Review Details",
+    "escalate": "Escalate",
+    "ignore": "Dismiss"
+})
+
+_ICONS = MappingProxyType({
+    "auto_fix": "🔧",
+    "manual_review": "👁",
+    "escalate": "⚠",
+    "ignore": "✓"
+})
+
+# Pulls the required action fields in one C call per action
+_ACTION_FIELDS = itemgetter("action_id", "title", "description",
+                            "action_type", "priority")
+
+_SEVERITY_COLORS = MappingProxyType({
+    "critical": "#ff0000",
+    "high": "#ff6600",
+    "medium": "#ffaa00",
+    "low": "#00aa00"
+})
+
+# Shared HTTP/2 client for all handler instances. One connection
+# multiplexes concurrent POSTs, and reuse avoids repeated TCP/TLS
+# handshakes and DNS lookups under bursty alert loads.
+_shared_client: Optional[httpx.AsyncClient] = None
+
+
+@lru_cache(maxsize=256)
+def _notification_shell(alert_type: str, severity: str) -> Dict:
+    """Prebuilt notification scaffold for an (alert_type, severity) pair.
+
+    Alerts mostly reuse a handful of type/severity combinations, so the
+    scaffold with its resolved color is built once and shallow-copied
+    per notification.
+    """
+    return {
+        "title": None,
+        "message": None,
+        "severity": severity,
+        "color": _SEVERITY_COLORS.get(severity, "#cccccc"),
+        "action_count": 0,
+        "recommended_action": None
+    }
+
+
+def _payload_key(payload: Dict) -> str:
+    """Stable digest of a prediction payload for deduplication."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+async def _get_shared_client() -> httpx.AsyncClient:
+    """Get or lazily create the shared pooled HTTP/2 client."""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=256,
+                max_keepalive_connections=256
+            )
+        )
+    return _shared_client
+
+
+@dataclass(slots=True, frozen=True)
 class Alert:
     """Security or CI alert data structure."""
     alert_id: str
@@ -30,7 +113,7 @@ class Alert:
     session_id: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RecommendedAction:
     """Action recommendation from predictive API."""
     action_id: str
@@ -45,32 +128,95 @@ class RecommendedAction:
 class AlertHandlerWithPredictiveActions:
     """Handle alerts with predictive action recommendations."""
     
-    def __init__(self, 
+    def __init__(self,
                  predictive_api_url: str = "http://ci-agent:8000",
-                 timeout: int = 10):
+                 timeout: int = 10,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5,
+                 max_batch: int = 32,
+                 max_wait_ms: int = 15,
+                 dedupe_ttl: float = 2.0,
+                 cache_ttl: float = 60.0,
+                 cache_size: int = 1024,
+                 flush_interval: float = 0.25,
+                 log_batch_size: int = 64):
         """Initialize alert handler.
-        
+
         Args:
             predictive_api_url: URL of predictive actions API
             timeout: Request timeout in seconds
+            max_retries: Retry attempts for connection errors
+            retry_backoff: Base delay for exponential backoff between retries
+            max_batch: Max alerts coalesced into one batch API call
+            max_wait_ms: Max time to wait for a batch to fill up
+            dedupe_ttl: Window during which identical payloads share one request
+            cache_ttl: How long successful responses are reused, in seconds
+            cache_size: Max cached responses
+            flush_interval: Max delay before buffered action logs are flushed
+            log_batch_size: Action logs POSTed per flush
         """
         self.api_url = predictive_api_url
         self.timeout = timeout
-        self.session: Optional[aiohttp.ClientSession] = None
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.dedupe_ttl = dedupe_ttl
+        self.session: Optional[httpx.AsyncClient] = None
         self.action_logs: List[Dict] = []
-    
+        self._batch_queue: asyncio.Queue = asyncio.Queue()
+        self._batch_task: Optional[asyncio.Task] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._response_cache = cachetools.TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.flush_interval = flush_interval
+        self.log_batch_size = log_batch_size
+        self._log_buffer: deque = deque(maxlen=10_000)
+        self._log_event = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
     async def __aenter__(self):
         """Async context manager entry."""
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=self.timeout)
-        )
+        self.session = await _get_shared_client()
         return self
-    
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """Async context manager exit."""
-        if self.session:
-            await self.session.close()
-    
+        """Async context manager exit (session is shared, kept open)."""
+        if self._batch_task:
+            self._batch_task.cancel()
+            self._batch_task = None
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # Don't drop telemetry buffered since the last flush
+        while self._log_buffer:
+            await self._flush_logs()
+
+    @classmethod
+    async def aclose(cls):
+        """Close the shared client at process shutdown."""
+        global _shared_client
+        if _shared_client and not _shared_client.is_closed:
+            await _shared_client.aclose()
+            _shared_client = None
+
+    async def _post_json(self, url: str, payload: Dict) -> Dict:
+        """POST with exponential-backoff retry on connection errors."""
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                response = await self.session.post(
+                    url, json=payload, timeout=self.timeout
+                )
+                if response.status_code != 200:
+                    raise Exception(f"API error: {response.status_code}")
+                return response.json()
+            except httpx.TransportError as e:
+                last_error = e
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"Connection error ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+        raise last_error
+
     async def handle_alert(self, alert: Alert) -> Dict:
         """Process alert and get predictive action recommendations.
         
@@ -82,42 +228,16 @@ class AlertHandlerWithPredictiveActions:
         """
         try:
             logger.info(f"Processing alert {alert.alert_id}: {alert.alert_type}")
-            
-            # Map alert type to failure type for API
-            failure_type_map = {
-                "security_alert": "security_alert",
-                "ci_failure": "ci_failure",
-                "spam_incident": "spam_incident"
-            }
-            failure_type = failure_type_map.get(alert.alert_type, "security_alert")
-            
-            # Call predictive actions API
+
+            # Call predictive actions API (coalesced with concurrent alerts)
             recommendations = await self._get_predictive_actions(
-                failure_description=alert.description,
-                failure_type=failure_type,
-                context=alert.context or {},
-                severity=alert.severity,
-                user_id=alert.user_id,
-                session_id=alert.session_id
+                self._build_payload(alert)
             )
-            
-            # Create response with UI-ready format
-            response = {
-                "alert_id": alert.alert_id,
-                "alert_type": alert.alert_type,
-                "timestamp": datetime.utcnow().isoformat(),
-                "request_id": recommendations["request_id"],
-                "actions": self._format_actions_for_ui(
-                    recommendations["actions"],
-                    recommendations["recommended_action_id"]
-                ),
-                "notification": self._create_notification(alert, recommendations),
-                "status": "ready_for_action"
-            }
-            
+
+            response = self._build_response(alert, recommendations)
             logger.info(f"Alert processed successfully with {len(response['actions'])} recommendations")
             return response
-            
+
         except Exception as e:
             logger.error(f"Error handling alert: {str(e)}")
             return {
@@ -125,134 +245,259 @@ class AlertHandlerWithPredictiveActions:
                 "status": "error",
                 "error": str(e)
             }
-    
-    async def _get_predictive_actions(self,
-                                      failure_description: str,
-                                      failure_type: str,
-                                      context: Dict,
-                                      severity: str,
-                                      user_id: Optional[str],
-                                      session_id: Optional[str]) -> Dict:
-        """Call predictive actions API endpoint."""
-        if not self.session:
-            raise RuntimeError("Session not initialized")
-        
-        url = f"{self.api_url}/api/predictive_actions"
-        payload = {
-            "failure_description": failure_description,
+
+    async def handle_alerts(self, alerts: List[Alert]) -> List[Dict]:
+        """Process multiple alerts with one batch API round trip.
+
+        Args:
+            alerts: Alerts to process together
+
+        Returns:
+            List of per-alert response dictionaries, in input order
+        """
+        if not alerts:
+            return []
+
+        payloads = [self._build_payload(alert) for alert in alerts]
+        try:
+            recommendations_list = await self._post_batch(payloads)
+        except Exception as e:
+            logger.error(f"Error handling alert batch: {str(e)}")
+            return [
+                {"alert_id": alert.alert_id, "status": "error", "error": str(e)}
+                for alert in alerts
+            ]
+
+        responses = []
+        for alert, recommendations in zip(alerts, recommendations_list):
+            try:
+                responses.append(self._build_response(alert, recommendations))
+            except Exception as e:
+                logger.error(f"Error handling alert: {str(e)}")
+                responses.append({
+                    "alert_id": alert.alert_id,
+                    "status": "error",
+                    "error": str(e)
+                })
+        return responses
+
+    def _build_payload(self, alert: Alert) -> Dict:
+        """Build predictive actions API payload for an alert."""
+        # Map alert type to failure type for API
+        failure_type = _FAILURE_TYPE_MAP.get(alert.alert_type, "security_alert")
+
+        return {
+            "failure_description": alert.description,
             "failure_type": failure_type,
-            "context": context,
-            "severity": severity,
-            "user_id": user_id,
-            "session_id": session_id
+            "context": alert.context or {},
+            "severity": alert.severity,
+            "user_id": alert.user_id,
+            "session_id": alert.session_id
         }
-        
-        async with self.session.post(url, json=payload) as response:
-            if response.status != 200:
-                raise Exception(f"API error: {response.status}")
-            return await response.json()
+
+    def _build_response(self, alert: Alert, recommendations: Dict) -> Dict:
+        """Create UI-ready response from API recommendations."""
+        return {
+            "alert_id": alert.alert_id,
+            "alert_type": alert.alert_type,
+            "timestamp": datetime.utcnow().isoformat(),
+            "request_id": recommendations["request_id"],
+            "actions": self._format_actions_for_ui(
+                recommendations["actions"],
+                recommendations["recommended_action_id"]
+            ),
+            "notification": self._create_notification(alert, recommendations),
+            "status": "ready_for_action"
+        }
+
+    async def _get_predictive_actions(self, payload: Dict) -> Dict:
+        """Get predictions for one alert via the shared batch dispatcher.
+
+        Identical payloads arriving within dedupe_ttl of each other share
+        one in-flight request instead of issuing duplicate POSTs, and
+        successful responses are reused for cache_ttl. Callers can mark a
+        payload uncacheable (e.g. its context carries a nonce) by setting
+        a truthy no_cache flag in the alert context.
+        """
+        if not self.session:
+            raise RuntimeError("Session not initialized")
+
+        key = _payload_key(payload)
+        cacheable = not payload["context"].get("no_cache")
+        if cacheable:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        existing = self._inflight.get(key)
+        if existing is not None:
+            return await existing
+
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.ensure_future(self._batch_dispatcher())
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        # Keep the entry briefly after completion so an identical burst
+        # keeps sharing the result, then let it expire
+        future.add_done_callback(
+            lambda _f: loop.call_later(self.dedupe_ttl, self._inflight.pop, key, None)
+        )
+
+        # Alias lets the API dedupe server-side too
+        await self._batch_queue.put((dict(payload, alias=key), future))
+        result = await future
+        if cacheable:
+            self._response_cache[key] = result
+        return result
+
+    async def _batch_dispatcher(self):
+        """Drain the request queue, packing alerts into batch API calls.
+
+        Packs up to max_batch requests or whatever arrives within
+        max_wait_ms of the first one, then resolves each waiter with its
+        slice of the batch response.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._batch_queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000.0
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._batch_queue.get(), remaining
+                    ))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await self._post_batch([p for p, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _post_batch(self, payloads: List[Dict]) -> List[Dict]:
+        """POST a batch of prediction requests in one round trip."""
+        if not self.session:
+            raise RuntimeError("Session not initialized")
+
+        url = f"{self.api_url}/api/predictive_actions/batch"
+        result = await self._post_json(url, {"requests": payloads})
+        return result["responses"]
     
-    def _format_actions_for_ui(self, actions: List[Dict], 
+    def _format_actions_for_ui(self, actions: List[Dict],
                                recommended_id: Optional[str]) -> List[Dict]:
         """Format actions for UI display."""
-        formatted = []
-        for idx, action in enumerate(actions):
-            is_recommended = action["action_id"] == recommended_id
-            
-            ui_action = {
-                "id": action["action_id"],
-                "title": action["title"],
-                "description": action["description"],
-                "type": action["action_type"],
-                "priority": action["priority"],
+        get_label = _BUTTON_LABELS.get
+        get_icon = _ICONS.get
+        return [
+            {
+                "id": action_id,
+                "title": title,
+                "description": description,
+                "type": action_type,
+                "priority": priority,
                 "estimated_time": action.get("estimated_time", "Unknown"),
-                "confidence": round((action.get("success_rate", 0) or 0) * 100),
-                "is_recommended": is_recommended,
-                "button_label": self._get_button_label(action["action_type"]),
-                "icon": self._get_icon(action["action_type"])
+                "confidence": math.trunc((action.get("success_rate", 0) or 0) * 100),
+                "is_recommended": action_id == recommended_id,
+                "button_label": get_label(action_type, "Action"),
+                "icon": get_icon(action_type, "➤")
             }
-            formatted.append(ui_action)
-        
-        return formatted
+            for action in actions
+            for action_id, title, description, action_type, priority
+            in (_ACTION_FIELDS(action),)
+        ]
     
-    def _get_button_label(self, action_type: str) -> str:
+    @staticmethod
+    def _get_button_label(action_type: str) -> str:
         """Get UI button label for action type."""
-        labels = {
-            "auto_fix": "Execute Fix",
-            "manual_review": "Review Details",
-            "escalate": "Escalate",
-            "ignore": "Dismiss"
-        }
-        return labels.get(action_type, "Action")
-    
-    def _get_icon(self, action_type: str) -> str:
+        return _BUTTON_LABELS.get(action_type, "Action")
+
+    @staticmethod
+    def _get_icon(action_type: str) -> str:
         """Get UI icon for action type."""
-        icons = {
-            "auto_fix": "🔧",
-            "manual_review": "👁",
-            "escalate": "⚠",
-            "ignore": "✓"
-        }
-        return icons.get(action_type, "➤")
-    
+        return _ICONS.get(action_type, "➤")
+
     def _create_notification(self, alert: Alert, recommendations: Dict) -> Dict:
         """Create notification for alert."""
-        severity_colors = {
-            "critical": "#ff0000",
-            "high": "#ff6600",
-            "medium": "#ffaa00",
-            "low": "#00aa00"
-        }
-        
-        return {
-            "title": alert.title,
-            "message": alert.description,
-            "severity": alert.severity,
-            "color": severity_colors.get(alert.severity, "#cccccc"),
-            "action_count": len(recommendations["actions"]),
-            "recommended_action": recommendations.get("recommended_action_id")
-        }
+        notification = _notification_shell(alert.alert_type, alert.severity).copy()
+        notification["title"] = alert.title
+        notification["message"] = alert.description
+        notification["action_count"] = len(recommendations["actions"])
+        notification["recommended_action"] = recommendations.get("recommended_action_id")
+        return notification
     
     async def log_user_action(self, request_id: str, action_id: str,
                               outcome: Optional[str] = None,
                               feedback: Optional[str] = None) -> Dict:
-        """Log user's action selection to API for ML training.
-        
+        """Log user's action selection for ML training, fire-and-forget.
+
+        The payload is buffered and flushed to the batch logging endpoint
+        in the background, so UI acknowledgement never waits on telemetry.
+
         Args:
             request_id: Original request ID
             action_id: Selected action ID
             outcome: Result (successful, failed, partial)
             feedback: User feedback
-            
+
         Returns:
-            Confirmation response
+            Queued-confirmation response
         """
         if not self.session:
             raise RuntimeError("Session not initialized")
-        
+
+        self._log_buffer.append({
+            "request_id": request_id,
+            "action_id": action_id,
+            "selected_at": datetime.utcnow().isoformat(),
+            "outcome": outcome,
+            "feedback": feedback
+        })
+        self._log_event.set()
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._log_flusher())
+
+        return {"status": "queued", "action_id": action_id}
+
+    async def _log_flusher(self):
+        """Background flusher for buffered action logs.
+
+        Wakes on the first buffered entry, then waits up to
+        flush_interval for more unless a full batch is already pending.
+        """
+        while True:
+            await self._log_event.wait()
+            if len(self._log_buffer) < self.log_batch_size:
+                await asyncio.sleep(self.flush_interval)
+            await self._flush_logs()
+
+    async def _flush_logs(self):
+        """POST one batch of buffered action logs."""
+        batch = []
+        while self._log_buffer and len(batch) < self.log_batch_size:
+            batch.append(self._log_buffer.popleft())
+        if not self._log_buffer:
+            self._log_event.clear()
+        if not batch:
+            return
+
         try:
-            url = f"{self.api_url}/api/actions/log_selection"
-            payload = {
-                "request_id": request_id,
-                "action_id": action_id,
-                "selected_at": datetime.utcnow().isoformat(),
-                "outcome": outcome,
-                "feedback": feedback
-            }
-            
-            async with self.session.post(url, json=payload) as response:
-                if response.status != 200:
-                    logger.error(f"Logging failed: {response.status}")
-                    return {"status": "error"}
-                
-                result = await response.json()
-                self.action_logs.append(result)
-                logger.info(f"Action selection logged: {action_id}")
-                return result
-                
+            url = f"{self.api_url}/api/actions/log_selection/batch"
+            result = await self._post_json(url, {"selections": batch})
+            self.action_logs.extend(result.get("results", batch))
+            logger.info(f"Flushed {len(batch)} action log(s)")
         except Exception as e:
-            logger.error(f"Error logging action: {str(e)}")
-            return {"status": "error", "error": str(e)}
+            logger.error(f"Error logging actions: {str(e)}")
     
     def get_logs(self) -> List[Dict]:
         """Get local action logs."""
@@ -290,6 +535,8 @@ async def example_alert_handling():
             )
             print(f"\nLogged: {log_result}")
 
+    await AlertHandlerWithPredictiveActions.aclose()
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
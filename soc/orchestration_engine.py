@@ -5,7 +5,11 @@ Orchestration Engine - Integration of Task Queue + Workflow Orchestrator + State
 Phase 2 Integration: Connects all components for unified workflow execution
 """
 
+import asyncio
+import cachetools
 import logging
+import re
+from datetime import datetime
 from typing import Dict, Any, Optional
 from enum import Enum
 from task_queue import TaskQueue, TaskPriority, TaskStatus
@@ -15,16 +19,73 @@ from state_machine import StateMachine, CaseState
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Single DFA pass extracts the handler key from a task name like
+# "case_intake_security_incident" instead of chained substring scans
+_TASK_KIND_RE = re.compile(r"(case_intake|analysis|remediation)")
+
+
+class _EvictingLRU(cachetools.LRUCache):
+    """LRU cache that hands evicted entries to a callback"""
+
+    def __init__(self, maxsize: int, evict):
+        super().__init__(maxsize)
+        self._evict = evict
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._evict(key, value)
+        return key, value
+
 
 class OrchestrationEngine:
     """Unified orchestration engine for AI-SOC workflows"""
 
-    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379):
+    STATE_KEY_PREFIX = "case_state:"
+
+    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379,
+                 max_cached_cases: int = 10_000):
         self.queue = TaskQueue(redis_host, redis_port)
         self.workflow_orchestrator = WorkflowOrchestrator()
-        self.state_machines: Dict[str, StateMachine] = {}
+        # Bounded LRU: least-recently-touched cases spill to Redis so
+        # memory stays capped and other engine workers can pick them up
+        self.state_machines: Dict[str, StateMachine] = _EvictingLRU(
+            max_cached_cases, self._persist_state_machine
+        )
+        self._consumer_task: Optional[asyncio.Task] = None
+        self._dispatch = {
+            "case_intake": self._handle_case_intake,
+            "analysis": self._handle_analysis,
+            "remediation": self._handle_remediation
+        }
         logger.info("OrchestrationEngine initialized")
 
+    def _persist_state_machine(self, case_id: str, sm: StateMachine):
+        """Persist an evicted state machine's state to Redis"""
+        self.queue.redis_client.hset(
+            f"{self.STATE_KEY_PREFIX}{case_id}",
+            mapping={
+                "state": sm.current_state.value,
+                "persisted_at": datetime.utcnow().isoformat()
+            }
+        )
+        logger.info(f"Case state persisted: {case_id} ({sm.current_state.value})")
+
+    def _get_or_load_sm(self, case_id: str) -> Optional[StateMachine]:
+        """Get a case state machine from the LRU, falling back to Redis"""
+        sm = self.state_machines.get(case_id)
+        if sm:
+            return sm
+
+        stored = self.queue.redis_client.hgetall(f"{self.STATE_KEY_PREFIX}{case_id}")
+        if not stored:
+            return None
+
+        sm = StateMachine(case_id)
+        sm.current_state = CaseState(stored['state'])
+        self.state_machines[case_id] = sm
+        logger.info(f"Case state restored from Redis: {case_id}")
+        return sm
+
     def create_case_workflow(self, case_id: str, case_type: str, 
                             priority: TaskPriority = TaskPriority.NORMAL) -> str:
         """Create new case workflow"""
@@ -48,44 +109,95 @@ class OrchestrationEngine:
         logger.info(f"Case workflow created: {case_id} with task {task_id}")
         return workflow_id
 
-    def process_tasks(self, batch_size: int = 10) -> int:
-        """Process queued tasks in batch"""
-        processed = 0
-        
-        for _ in range(batch_size):
-            task = self.queue.dequeue_task()
-            if not task:
-                break
-            
-            try:
-                result = self._execute_task(task)
-                self.queue.mark_task_completed(task['task_id'], result)
-                processed += 1
-            except Exception as e:
-                logger.error(f"Task failed: {task['task_id']} - {str(e)}")
-                self.queue.mark_task_failed(task['task_id'], str(e))
-        
-        return processed
+    async def process_tasks(self, batch_size: int = 10) -> int:
+        """Process queued tasks as one concurrent batch.
+
+        Fetches up to batch_size tasks in a single pipelined round trip,
+        executes them concurrently, then marks completions with one more
+        pipelined update instead of per-task round trips.
+        """
+        tasks = await asyncio.to_thread(self.queue.dequeue_tasks, batch_size)
+        if not tasks:
+            return 0
+
+        outcomes = await asyncio.gather(
+            *[self._execute_task_async(task) for task in tasks],
+            return_exceptions=True
+        )
+
+        completed = []
+        for task, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Task failed: {task['task_id']} - {str(outcome)}")
+                await asyncio.to_thread(
+                    self.queue.mark_task_failed, task['task_id'], str(outcome)
+                )
+            else:
+                completed.append(task['task_id'])
+
+        if completed:
+            await asyncio.to_thread(self.queue.mark_tasks_completed, completed)
+        return len(completed)
+
+    def start_consumer(self, batch_size: int = 10, idle_wait: float = 1.0) -> asyncio.Task:
+        """Start a background consumer so enqueue never blocks dequeue"""
+        if self._consumer_task is None or self._consumer_task.done():
+            self._consumer_task = asyncio.create_task(
+                self._consume_loop(batch_size, idle_wait)
+            )
+        return self._consumer_task
+
+    def stop_consumer(self):
+        """Stop the background consumer"""
+        if self._consumer_task:
+            self._consumer_task.cancel()
+            self._consumer_task = None
+
+    async def _consume_loop(self, batch_size: int, idle_wait: float):
+        """Continuously drain the queue in concurrent batches.
+
+        When the queue runs dry, parks in a server-side blocking pop for
+        up to idle_wait seconds instead of sleep-polling, so an idle
+        consumer costs one outstanding BZPOPMIN rather than RPOP spam.
+        """
+        while True:
+            processed = await self.process_tasks(batch_size)
+            if processed == 0:
+                task = await asyncio.to_thread(self.queue.dequeue_task, idle_wait)
+                if task:
+                    await self._run_single(task)
+
+    async def _run_single(self, task: Dict[str, Any]):
+        """Execute one task and record its outcome"""
+        task_id = task['task_id']
+        try:
+            await self._execute_task_async(task)
+        except Exception as e:
+            logger.error(f"Task failed: {task_id} - {str(e)}")
+            await asyncio.to_thread(self.queue.mark_task_failed, task_id, str(e))
+        else:
+            await asyncio.to_thread(self.queue.mark_task_completed, task_id)
+
+    async def _execute_task_async(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """Run task execution in a worker thread so gather() overlaps the
+        batch and the handlers' blocking Redis calls stay off the loop"""
+        return await asyncio.to_thread(self._execute_task, task)
 
     def _execute_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """Execute single task with workflow orchestration"""
         task_name = task['name']
         payload = task['payload']
-        
-        if 'case_intake' in task_name:
-            return self._handle_case_intake(payload)
-        elif 'analysis' in task_name:
-            return self._handle_analysis(payload)
-        elif 'remediation' in task_name:
-            return self._handle_remediation(payload)
-        else:
+
+        match = _TASK_KIND_RE.search(task_name)
+        if not match:
             raise ValueError(f"Unknown task: {task_name}")
+        return self._dispatch[match.group(1)](payload)
 
     def _handle_case_intake(self, payload: Dict) -> Dict[str, Any]:
         """Handle case intake workflow"""
         case_id = payload['case_id']
-        sm = self.state_machines.get(case_id)
-        
+        sm = self._get_or_load_sm(case_id)
+
         if sm:
             sm.transition(CaseState.INTAKE_VALIDATION)
         
@@ -94,8 +206,8 @@ class OrchestrationEngine:
     def _handle_analysis(self, payload: Dict) -> Dict[str, Any]:
         """Handle analysis workflow"""
         case_id = payload['case_id']
-        sm = self.state_machines.get(case_id)
-        
+        sm = self._get_or_load_sm(case_id)
+
         if sm:
             sm.transition(CaseState.ANALYZING)
         
@@ -104,8 +216,8 @@ class OrchestrationEngine:
     def _handle_remediation(self, payload: Dict) -> Dict[str, Any]:
         """Handle remediation workflow"""
         case_id = payload['case_id']
-        sm = self.state_machines.get(case_id)
-        
+        sm = self._get_or_load_sm(case_id)
+
         if sm:
             sm.transition(CaseState.REMEDIATION_IN_PROGRESS)
             sm.transition(CaseState.REMEDIATION_COMPLETED)
@@ -114,7 +226,7 @@ class OrchestrationEngine:
 
     def get_case_status(self, case_id: str) -> Dict[str, Any]:
         """Get current case status"""
-        sm = self.state_machines.get(case_id)
+        sm = self._get_or_load_sm(case_id)
         if not sm:
             return {"status": "not_found"}
         
@@ -147,7 +259,7 @@ if __name__ == "__main__":
     )
     
     # Process tasks
-    processed = engine.process_tasks(batch_size=5)
+    processed = asyncio.run(engine.process_tasks(batch_size=5))
     print(f"Processed {processed} tasks")
     
     # Get metrics
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""Optional mypyc build for the hot task-queue path.
+
+Compiling task_queue.py lowers its dict/attribute work to C-level
+dispatch (typically 2-4x on the serialization-heavy sections) without
+any logic changes; TaskPriority/TaskStatus are IntEnum/str enums so
+comparisons compile down to integer/string ops. The service runs fine
+uncompiled - this is opt-in:
+
+    pip install mypy
+    python setup.py build_ext --inplace
+"""
+
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name="soc-hotpath",
+    ext_modules=mypycify(["task_queue.py"])
+)
@@ -9,20 +9,23 @@ Phase 2 Component: Task Queue Management System
 - Integration with workflow orchestration
 """
 
-import json
 import logging
+import orjson
+import os
 import redis
+import time
 import uuid
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from enum import Enum
-from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Tuple, cast
+from enum import Enum, IntEnum
+from dataclasses import dataclass
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class TaskPriority(Enum):
+class TaskPriority(IntEnum):
     """Task priority levels for job queue"""
     LOW = 0
     NORMAL = 1
@@ -30,7 +33,7 @@ class TaskPriority(Enum):
     URGENT = 3
 
 
-class TaskStatus(Enum):
+class TaskStatus(str, Enum):
     """Task execution status"""
     PENDING = "pending"
     RUNNING = "running"
@@ -40,7 +43,138 @@ class TaskStatus(Enum):
     DEAD_LETTERED = "dead_lettered"
 
 
-@dataclass
+# Priority band separating scores in the unified sorted-set queue.
+# Ready tasks score -(priority + 1) * band + created_at_ms, so higher
+# priorities sort first and FIFO holds within a band; the band is wider
+# than any epoch-ms value, so bands never overlap. Scheduled tasks use
+# their (positive) due time in epoch-ms and therefore sort after all
+# ready tasks.
+_PRIORITY_BAND = 10 ** 13
+
+# Atomically enqueue a task member and write its metadata hash in one RTT.
+# KEYS[1]=queue zset, KEYS[2]=metadata hash
+# ARGV[1]=score, ARGV[2]=task member, ARGV[3..]=metadata field/value pairs
+_ENQUEUE_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[2], 86400)
+return 1
+"""
+
+# Transition task status (plus optional timestamp field) in one RTT.
+# KEYS[1]=metadata hash
+# ARGV[1]=new status, ARGV[2]=timestamp field name ('' for none), ARGV[3]=now
+_STATUS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1])
+if ARGV[2] ~= '' then
+  redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], 86400)
+return 1
+"""
+
+# Handle a task failure server-side: read retry state, then either
+# schedule a delayed retry or move the task to the dead letter queue,
+# all in one RTT. Returns the new retry count, 0 when dead-lettered,
+# or -1 when metadata is missing.
+# KEYS[1]=metadata hash, KEYS[2]=queue zset, KEYS[3]=dead letter list
+# ARGV[1]=error message, ARGV[2]=now iso, ARGV[3]=now epoch-ms
+_FAIL_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return -1
+end
+local meta = {}
+local raw = redis.call('HGETALL', KEYS[1])
+for i = 1, #raw, 2 do
+  meta[raw[i]] = raw[i + 1]
+end
+local retry_count = tonumber(meta['retry_count'] or '0')
+local max_retries = tonumber(meta['max_retries'] or '3')
+if retry_count < max_retries then
+  retry_count = retry_count + 1
+  redis.call('HSET', KEYS[1], 'retry_count', retry_count,
+             'status', 'retrying', 'error_message', ARGV[1])
+  redis.call('EXPIRE', KEYS[1], 86400)
+  local delay = math.min(60, 2 ^ retry_count)
+  local member = cjson.encode({
+    task_id = meta['task_id'],
+    name = meta['name'],
+    payload = meta['payload'] or '{}',
+    priority = tonumber(meta['priority'] or '1'),
+    retry_count = retry_count
+  })
+  redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) + delay * 1000, member)
+  return retry_count
+end
+redis.call('HSET', KEYS[1], 'status', 'dead_lettered', 'error_message', ARGV[1])
+redis.call('EXPIRE', KEYS[1], 86400)
+meta['status'] = 'dead_lettered'
+meta['error_message'] = ARGV[1]
+redis.call('LPUSH', KEYS[3], cjson.encode({
+  task_id = meta['task_id'],
+  metadata = meta,
+  dead_lettered_at = ARGV[2]
+}))
+return 0
+"""
+
+# Metadata hash fields stored as integers
+_INT_FIELDS = ('priority', 'retry_count', 'max_retries', 'timeout_seconds')
+
+
+# Timestamp cache: the second-level prefix is only reformatted when the
+# second changes, so per-task calls just append the microsecond suffix.
+# Stored as one (second, prefix) tuple so threads never observe a second
+# paired with another second's prefix.
+_ts_cache = (0, '')
+
+# Pre-generated task ids: one os.urandom syscall refills the whole pool
+# instead of one per uuid4() call.
+_UUID_BATCH = 1024
+_uuid_pool: deque = deque()
+
+
+def _utcnow_iso() -> str:
+    """UTC timestamp in datetime.isoformat() layout, with cached prefix"""
+    global _ts_cache
+    second, remainder_ns = divmod(time.time_ns(), 1_000_000_000)
+    cached_second, prefix = _ts_cache
+    if second != cached_second:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        _ts_cache = (second, prefix)
+    return f"{prefix}.{remainder_ns // 1000:06d}"
+
+
+def _next_task_id() -> str:
+    """Get a random task id from the pre-generated pool"""
+    if not _uuid_pool:
+        rand = os.urandom(16 * _UUID_BATCH)
+        _uuid_pool.extend(
+            str(uuid.UUID(bytes=rand[i:i + 16], version=4))
+            for i in range(0, len(rand), 16)
+        )
+    return _uuid_pool.popleft()
+
+
+def _ready_score(priority: TaskPriority, created_at_ms: int) -> int:
+    """Compute queue score for an immediately runnable task"""
+    return -((priority.value + 1) * _PRIORITY_BAND) + created_at_ms
+
+
+def _priority_score_range(priority: TaskPriority) -> tuple:
+    """Score range (min, max) covering ready tasks of one priority"""
+    low = -((priority.value + 1) * _PRIORITY_BAND)
+    return low, low + _PRIORITY_BAND - 1
+
+
+# Precomputed at import so stats/clear calls skip the per-call arithmetic
+_PRIORITY_RANGES = {p: _priority_score_range(p) for p in TaskPriority}
+
+
+@dataclass(slots=True, frozen=True)
 class TaskMetadata:
     """Task metadata for tracking and scheduling"""
     task_id: str
@@ -56,21 +190,64 @@ class TaskMetadata:
     error_message: Optional[str] = None
     timeout_seconds: int = 3600
 
+    def _to_wire(self) -> Dict[str, Any]:
+        """Flat field dict for Redis: priority as int, status as str.
+
+        Writes enum values directly instead of going through asdict()'s
+        recursive walk plus a per-field Enum check, and skips unset
+        fields entirely.
+        """
+        wire = {
+            "task_id": self.task_id,
+            "name": self.name,
+            "priority": self.priority.value,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "retry_count": self.retry_count,
+            "max_retries": self.max_retries,
+            "timeout_seconds": self.timeout_seconds
+        }
+        if self.scheduled_at:
+            wire["scheduled_at"] = self.scheduled_at
+        if self.started_at:
+            wire["started_at"] = self.started_at
+        if self.completed_at:
+            wire["completed_at"] = self.completed_at
+        if self.error_message:
+            wire["error_message"] = self.error_message
+        return wire
+
 
 class TaskQueue:
     """Redis-backed task queue with priority and retry management"""
 
-    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379, db: int = 0):
+    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379, db: int = 0,
+                 max_connections: int = 256, visibility_timeout: int = 300):
         """Initialize Redis connection"""
+        # BlockingConnectionPool makes workers wait briefly for a free
+        # connection under load instead of erroring out past the limit
         self.redis_client = redis.Redis(
-            host=redis_host,
-            port=redis_port,
-            db=db,
-            decode_responses=True
+            connection_pool=redis.BlockingConnectionPool(
+                host=redis_host,
+                port=redis_port,
+                db=db,
+                decode_responses=True,
+                max_connections=max_connections,
+                timeout=5
+            )
         )
-        self.queue_prefix = "task_queue:"
+        self.queue_key = "task_queue:pq"
+        self.processing_key = "task_queue:processing"
         self.metadata_prefix = "task_meta:"
         self.dead_letter_queue = "task_queue:dead_letter"
+        # At-least-once delivery: dequeued members sit in a processing
+        # set until acked; unacked members are reclaimable after this
+        # many seconds
+        self.visibility_timeout = visibility_timeout
+        self._processing_members: Dict[str, str] = {}
+        self._enqueue_script = self.redis_client.register_script(_ENQUEUE_LUA)
+        self._status_script = self.redis_client.register_script(_STATUS_LUA)
+        self._fail_script = self.redis_client.register_script(_FAIL_LUA)
         self._verify_connection()
 
     def _verify_connection(self) -> bool:
@@ -87,192 +264,280 @@ class TaskQueue:
                      priority: TaskPriority = TaskPriority.NORMAL,
                      scheduled_delay: Optional[int] = None) -> str:
         """Enqueue a new task with priority"""
-        task_id = str(uuid.uuid4())
+        task_id = _next_task_id()
+        now_ms = time.time_ns() // 1_000_000
         metadata = TaskMetadata(
             task_id=task_id,
             name=task_name,
             priority=priority,
             status=TaskStatus.PENDING,
-            created_at=datetime.utcnow().isoformat(),
-            scheduled_at=None if not scheduled_delay 
+            created_at=_utcnow_iso(),
+            scheduled_at=None if not scheduled_delay
                 else (datetime.utcnow() + timedelta(seconds=scheduled_delay)).isoformat()
         )
-        
-        queue_key = f"{self.queue_prefix}{priority.name}"
-        
+
         task_data = {
             "task_id": task_id,
             "name": task_name,
-            "payload": json.dumps(payload),
+            "payload": orjson.dumps(payload).decode(),
             "priority": priority.value,
             "created_at": metadata.created_at
         }
-        
-        self.redis_client.lpush(queue_key, json.dumps(task_data))
-        self.redis_client.setex(
-            f"{self.metadata_prefix}{task_id}",
-            86400,  # 24-hour expiry
-            json.dumps(asdict(metadata), default=str)
+
+        if scheduled_delay:
+            # Positive due-time score: sorts after all ready tasks
+            score = now_ms + scheduled_delay * 1000
+        else:
+            score = _ready_score(priority, now_ms)
+
+        script_args: List[Any] = [score, orjson.dumps(task_data)]
+        for field, value in metadata._to_wire().items():
+            script_args.extend((field, value))
+        script_args.extend(('payload', task_data['payload']))
+
+        self._enqueue_script(
+            keys=[self.queue_key, f"{self.metadata_prefix}{task_id}"],
+            args=script_args
         )
-        
+
         logger.info(f"Task enqueued: {task_id} ({task_name}) with priority {priority.name}")
         return task_id
 
-    def dequeue_task(self) -> Optional[Dict[str, Any]]:
-        """Dequeue next task from highest priority queue"""
-        for priority in sorted(TaskPriority, key=lambda x: x.value, reverse=True):
-            queue_key = f"{self.queue_prefix}{priority.name}"
-            task_data = self.redis_client.rpop(queue_key)
-            
-            if task_data:
-                task = json.loads(task_data)
-                task_id = task['task_id']
-                
-                # Update status to RUNNING
-                self._update_task_status(task_id, TaskStatus.RUNNING)
-                logger.info(f"Task dequeued: {task_id}")
-                return task
-        
-        return None
+    def dequeue_task(self, timeout: float = 0.1) -> Optional[Dict[str, Any]]:
+        """Dequeue highest-priority task with one blocking round trip"""
+        popped = self.redis_client.bzpopmin(self.queue_key, timeout=timeout)
+        if not popped:
+            return None
+
+        # redis-py types replies as bytes|str unions; decode_responses=True
+        # guarantees str members, so narrow with casts
+        task_data = cast(str, popped[1])
+        score = cast(float, popped[2])
+        if not self._is_due(score):
+            # Scheduled task not yet runnable: put it back, then wait out
+            # the remaining timeout (or until it comes due). BZPOPMIN
+            # returns instantly on a non-empty set, so without this an
+            # idle consumer would spin at 2 RTTs per iteration until the
+            # head's due time.
+            self.redis_client.zadd(self.queue_key, {task_data: score})
+            due_in = score / 1000 - time.time()
+            time.sleep(max(0.0, min(due_in, timeout)))
+            return None
+
+        task = orjson.loads(task_data)
+        task_id = task['task_id']
+        self._track_processing({task_data: task_id})
+
+        # Update status to RUNNING
+        self._update_task_status(task_id, TaskStatus.RUNNING)
+        logger.info(f"Task dequeued: {task_id}")
+        return task
+
+    def dequeue_tasks(self, count: int = 10) -> List[Dict[str, Any]]:
+        """Dequeue up to count tasks across all priorities in one round trip"""
+        popped = cast(
+            List[Tuple[str, float]], self.redis_client.zpopmin(self.queue_key, count)
+        )
+        if not popped:
+            return []
+
+        tasks: List[Dict[str, Any]] = []
+        members: Dict[str, str] = {}
+        not_due: Dict[str, float] = {}
+        for task_data, score in popped:
+            if self._is_due(score):
+                task = orjson.loads(task_data)
+                tasks.append(task)
+                members[task_data] = task['task_id']
+            else:
+                not_due[task_data] = score
+
+        if not_due:
+            self.redis_client.zadd(self.queue_key, not_due)
+
+        if tasks:
+            self._track_processing(members)
+            self._update_task_statuses(
+                [task['task_id'] for task in tasks], TaskStatus.RUNNING
+            )
+            logger.info(f"Dequeued batch of {len(tasks)} tasks")
+        return tasks
+
+    @staticmethod
+    def _is_due(score: float) -> bool:
+        """Check whether a popped queue member is runnable now.
+
+        Ready tasks carry negative scores; scheduled tasks carry their
+        due time in epoch-ms.
+        """
+        return score < 0 or score <= time.time_ns() // 1_000_000
+
+    def _track_processing(self, members: Dict[str, str]):
+        """Record dequeued members in the processing set until acked"""
+        deadline = time.time_ns() // 1_000_000 + self.visibility_timeout * 1000
+        self.redis_client.zadd(
+            self.processing_key, {member: deadline for member in members}
+        )
+        for member, task_id in members.items():
+            self._processing_members[task_id] = member
+
+    def _ack(self, task_ids: List[str]):
+        """Drop acked tasks from the processing set"""
+        members = [
+            self._processing_members.pop(task_id)
+            for task_id in task_ids
+            if task_id in self._processing_members
+        ]
+        if members:
+            self.redis_client.zrem(self.processing_key, *members)
+
+    def reclaim_stale_tasks(self, limit: int = 100) -> int:
+        """Re-queue tasks whose worker never acked in time.
+
+        The equivalent of a stream consumer group's XAUTOCLAIM: members
+        still in the processing set past their visibility deadline go
+        back on the queue as ready tasks.
+        """
+        now_ms = time.time_ns() // 1_000_000
+        stale = cast(List[str], self.redis_client.zrangebyscore(
+            self.processing_key, '-inf', now_ms, start=0, num=limit
+        ))
+        if not stale:
+            return 0
+
+        pipe = self.redis_client.pipeline()
+        pipe.zrem(self.processing_key, *stale)
+        for member in stale:
+            task = orjson.loads(member)
+            priority = TaskPriority(task.get('priority', TaskPriority.NORMAL.value))
+            pipe.zadd(self.queue_key, {member: _ready_score(priority, now_ms)})
+        pipe.execute()
+
+        logger.warning(f"Reclaimed {len(stale)} stale task(s)")
+        return len(stale)
 
     def mark_task_completed(self, task_id: str, result: Optional[Dict] = None) -> bool:
         """Mark task as completed"""
+        self._ack([task_id])
         return self._update_task_status(task_id, TaskStatus.COMPLETED, result=result)
 
+    def mark_tasks_completed(self, task_ids: List[str]) -> int:
+        """Mark a batch of tasks as completed in one pipelined update"""
+        self._ack(task_ids)
+        return self._update_task_statuses(task_ids, TaskStatus.COMPLETED)
+
     def mark_task_failed(self, task_id: str, error: str) -> bool:
-        """Mark task as failed and handle retry logic"""
-        metadata_key = f"{self.metadata_prefix}{task_id}"
-        metadata_data = self.redis_client.get(metadata_key)
-        
-        if not metadata_data:
+        """Mark task as failed and handle retry logic.
+
+        The retry-or-dead-letter decision runs server-side in one Lua
+        round trip: the script reads retry state, schedules a delayed
+        retry on the queue, or moves the task to the dead letter queue.
+        """
+        self._ack([task_id])
+        result = self._fail_script(
+            keys=[f"{self.metadata_prefix}{task_id}", self.queue_key,
+                  self.dead_letter_queue],
+            args=[error, _utcnow_iso(), time.time_ns() // 1_000_000]
+        )
+
+        if result == -1:
             logger.error(f"Task metadata not found: {task_id}")
             return False
-        
-        metadata = json.loads(metadata_data)
-        retry_count = metadata.get('retry_count', 0)
-        max_retries = metadata.get('max_retries', 3)
-        
-        if retry_count < max_retries:
-            # Schedule retry
-            retry_count += 1
-            metadata['retry_count'] = retry_count
-            metadata['status'] = TaskStatus.RETRYING.value
-            metadata['error_message'] = error
-            
-            self.redis_client.setex(
-                metadata_key,
-                86400,
-                json.dumps(metadata, default=str)
-            )
-            
-            # Re-enqueue for retry with delay
-            task_data = {
-                "task_id": task_id,
-                "name": metadata['name'],
-                "payload": metadata.get('payload', '{}'),
-                "priority": metadata.get('priority', TaskPriority.NORMAL.value),
-                "retry_count": retry_count
-            }
-            
-            queue_key = f"{self.queue_prefix}{TaskPriority(metadata['priority']).name}"
-            self.redis_client.lpush(queue_key, json.dumps(task_data))
-            
-            logger.info(f"Task scheduled for retry: {task_id} (attempt {retry_count}/{max_retries})")
+        if result == 0:
+            logger.warning(f"Task moved to dead letter queue: {task_id} - {error}")
             return True
-        else:
-            # Move to dead letter queue
-            return self._move_to_dead_letter(task_id, error)
-
-    def _move_to_dead_letter(self, task_id: str, error: str) -> bool:
-        """Move failed task to dead letter queue"""
-        metadata_key = f"{self.metadata_prefix}{task_id}"
-        metadata_data = self.redis_client.get(metadata_key)
-        
-        if not metadata_data:
-            return False
-        
-        metadata = json.loads(metadata_data)
-        metadata['status'] = TaskStatus.DEAD_LETTERED.value
-        metadata['error_message'] = error
-        
-        self.redis_client.lpush(
-            self.dead_letter_queue,
-            json.dumps({
-                "task_id": task_id,
-                "metadata": metadata,
-                "dead_lettered_at": datetime.utcnow().isoformat()
-            }, default=str)
-        )
-        
-        logger.warning(f"Task moved to dead letter queue: {task_id} - {error}")
+
+        logger.info(f"Task scheduled for retry: {task_id} (attempt {result})")
         return True
 
-    def _update_task_status(self, task_id: str, status: TaskStatus, 
+    def _update_task_status(self, task_id: str, status: TaskStatus,
                            result: Optional[Dict] = None) -> bool:
         """Update task status metadata"""
-        metadata_key = f"{self.metadata_prefix}{task_id}"
-        metadata_data = self.redis_client.get(metadata_key)
-        
-        if not metadata_data:
-            logger.error(f"Task metadata not found: {task_id}")
-            return False
-        
-        metadata = json.loads(metadata_data)
-        metadata['status'] = status.value
-        
+        return self._update_task_statuses([task_id], status) == 1
+
+    def _update_task_statuses(self, task_ids: List[str], status: TaskStatus) -> int:
+        """Update status metadata for a batch of tasks in one round trip"""
+        if not task_ids:
+            return 0
+
         if status == TaskStatus.RUNNING:
-            metadata['started_at'] = datetime.utcnow().isoformat()
+            time_field = 'started_at'
         elif status == TaskStatus.COMPLETED:
-            metadata['completed_at'] = datetime.utcnow().isoformat()
-        
-        self.redis_client.setex(
-            metadata_key,
-            86400,
-            json.dumps(metadata, default=str)
-        )
-        
-        logger.info(f"Task status updated: {task_id} -> {status.value}")
-        return True
+            time_field = 'completed_at'
+        else:
+            time_field = ''
+        now = _utcnow_iso()
+
+        pipe = self.redis_client.pipeline()
+        for task_id in task_ids:
+            self._status_script(
+                keys=[f"{self.metadata_prefix}{task_id}"],
+                args=[status.value, time_field, now],
+                client=pipe
+            )
+        results = pipe.execute()
+
+        updated = 0
+        for task_id, found in zip(task_ids, results):
+            if found:
+                updated += 1
+            else:
+                logger.error(f"Task metadata not found: {task_id}")
+
+        logger.info(f"Task status updated: {len(task_ids)} task(s) -> {status.value}")
+        return updated
 
     def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """Get current task status and metadata"""
-        metadata_key = f"{self.metadata_prefix}{task_id}"
-        metadata_data = self.redis_client.get(metadata_key)
-        
-        if not metadata_data:
+        metadata = cast(
+            Dict[str, Any],
+            self.redis_client.hgetall(f"{self.metadata_prefix}{task_id}")
+        )
+
+        if not metadata:
             return None
-        
-        return json.loads(metadata_data)
+
+        for field in _INT_FIELDS:
+            if field in metadata:
+                metadata[field] = int(metadata[field])
+        return metadata
 
     def get_queue_stats(self) -> Dict[str, int]:
-        """Get current queue statistics"""
-        stats = {}
-        
+        """Get current queue statistics in one pipelined round trip"""
+        pipe = self.redis_client.pipeline()
         for priority in TaskPriority:
-            queue_key = f"{self.queue_prefix}{priority.name}"
-            queue_length = self.redis_client.llen(queue_key)
-            stats[f"{priority.name}_queue"] = queue_length
-        
-        dead_letter_length = self.redis_client.llen(self.dead_letter_queue)
-        stats['dead_letter_queue'] = dead_letter_length
-        
+            low, high = _PRIORITY_RANGES[priority]
+            pipe.zcount(self.queue_key, low, high)
+        pipe.zcount(self.queue_key, 0, '+inf')
+        pipe.llen(self.dead_letter_queue)
+        counts = pipe.execute()
+
+        stats = {
+            f"{priority.name}_queue": count
+            for priority, count in zip(TaskPriority, counts)
+        }
+        stats['scheduled'] = counts[-2]
+        stats['dead_letter_queue'] = counts[-1]
+
         return stats
 
     def get_dead_letter_tasks(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Retrieve tasks from dead letter queue"""
         tasks = self.redis_client.lrange(self.dead_letter_queue, 0, limit - 1)
-        return [json.loads(task) for task in tasks]
+        return [orjson.loads(task) for task in tasks]
 
     def clear_queue(self, priority: Optional[TaskPriority] = None) -> bool:
-        """Clear queue (for testing/maintenance)"""
+        """Clear queue (for testing/maintenance).
+
+        Clearing a single priority only removes its ready tasks;
+        scheduled tasks are removed by a full clear.
+        """
         if priority:
-            queue_key = f"{self.queue_prefix}{priority.name}"
-            self.redis_client.delete(queue_key)
+            low, high = _PRIORITY_RANGES[priority]
+            self.redis_client.zremrangebyscore(self.queue_key, low, high)
             logger.info(f"Cleared {priority.name} queue")
         else:
-            for p in TaskPriority:
-                queue_key = f"{self.queue_prefix}{p.name}"
-                self.redis_client.delete(queue_key)
+            self.redis_client.delete(self.queue_key)
             logger.info("Cleared all queues")
         return True
 